@@ -7,10 +7,21 @@ import smtplib
 import gspread
 import threading
 import time
+import sys
+import hmac
+import cProfile
+import marshal
+import traceback
+import functools
+import heapq
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque, OrderedDict, Counter
+from contextlib import contextmanager
 from datetime import datetime, timedelta
-from flask import Flask, request, Response
+from flask import Flask, request, Response, g, has_request_context
 from twilio.rest import Client
 from twilio.twiml.messaging_response import MessagingResponse
+from twilio.request_validator import RequestValidator
 from logging.handlers import RotatingFileHandler
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
@@ -32,6 +43,19 @@ TWILIO_ACCOUNT_SID = os.environ.get('TWILIO_ACCOUNT_SID', 'your_twilio_sid')
 TWILIO_AUTH_TOKEN = os.environ.get('TWILIO_AUTH_TOKEN', 'your_twilio_token')
 TWILIO_PHONE_NUMBER = os.environ.get('TWILIO_PHONE_NUMBER', '+14155238886')
 
+# Configurações de status de entrega (callback Twilio)
+STATUS_CALLBACK_URL = os.environ.get('STATUS_CALLBACK_URL', '')  # URL pública de /status-callback
+STATUS_INDEX_MAX = int(os.environ.get('STATUS_INDEX_MAX', 10000))
+STATUS_FLUSH_INTERVAL = float(os.environ.get('STATUS_FLUSH_INTERVAL', 30))  # Segundos entre gravações em lote
+STATUS_STORE_PATH = os.environ.get('STATUS_STORE_PATH', 'status_entregas.jsonl')
+STATUS_MAX_RETRIES = int(os.environ.get('STATUS_MAX_RETRIES', 2))
+STATUS_RETRY_DELAY = float(os.environ.get('STATUS_RETRY_DELAY', 60))  # Segundos, multiplicado pela tentativa
+
+# Configurações de disparo de lembretes
+LEMBRETE_JANELA = float(os.environ.get('LEMBRETE_JANELA', 60))  # Segundos agrupados em um mesmo lote
+LEMBRETE_WORKERS = int(os.environ.get('LEMBRETE_WORKERS', 8))  # Envios simultâneos ao Twilio
+LEMBRETE_HORIZONTE_MOTORISTA = float(os.environ.get('LEMBRETE_HORIZONTE_MOTORISTA', 24))  # Horas de viagens listadas no resumo
+
 # Configurações Google Sheets
 GOOGLE_CREDS_JSON = os.environ.get('GOOGLE_CREDS_JSON')
 if GOOGLE_CREDS_JSON:
@@ -54,6 +78,13 @@ SMTP_USER = os.environ.get('SMTP_USER', 'your_smtp_user')
 SMTP_PASSWORD = os.environ.get('SMTP_PASSWORD', 'your_smtp_password')
 EMAIL_FROM = os.environ.get('EMAIL_FROM', 'alinebot@jcm.com')
 
+# Configurações de perfilamento (desativado por padrão)
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+PROFILING_TOKEN = os.environ.get('PROFILING_TOKEN', '')
+PROFILING_SAMPLE_RATE = float(os.environ.get('PROFILING_SAMPLE_RATE', 0.01))  # Fração de /webhook perfilada
+PROFILING_MAX_DUMPS = int(os.environ.get('PROFILING_MAX_DUMPS', 20))
+SLOW_REQUEST_MS = float(os.environ.get('SLOW_REQUEST_MS', 2000))
+
 # Inicialização segura do cliente Twilio
 try:
     twilio_client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
@@ -101,6 +132,145 @@ class UserState:
 
 state_manager = UserState()
 
+# ================= PERFILAMENTO EM PRODUÇÃO =================
+class Perfilador:
+    """Guarda dumps de cProfile e registros de requisições lentas em memória"""
+    def __init__(self, max_itens):
+        self.lock = threading.Lock()
+        self.perfil_ativo = threading.Lock()  # Um cProfile por vez no processo
+        self.dumps = deque(maxlen=max_itens)
+        self.lentas = deque(maxlen=max_itens * 5)
+        self.contador = 0
+
+    def adicionar_dump(self, rota, duracao_ms, stats):
+        with self.lock:
+            self.contador += 1
+            dump_id = f"PROF_{self.contador:05d}"
+            self.dumps.append({
+                'id': dump_id,
+                'rota': rota,
+                'duracao_ms': round(duracao_ms, 1),
+                'timestamp': datetime.now().isoformat(),
+                'dados': marshal.dumps(stats)
+            })
+        return dump_id
+
+    def obter_dump(self, dump_id):
+        with self.lock:
+            for dump in self.dumps:
+                if dump['id'] == dump_id:
+                    return dump
+        return None
+
+    def listar_dumps(self):
+        with self.lock:
+            return [{k: v for k, v in d.items() if k != 'dados'} for d in self.dumps]
+
+    def registrar_lenta(self, registro):
+        with self.lock:
+            self.lentas.append(registro)
+
+    def listar_lentas(self):
+        with self.lock:
+            return list(self.lentas)
+
+perfilador = Perfilador(PROFILING_MAX_DUMPS)
+
+@contextmanager
+def medir_etapa(nome):
+    """Acumula o tempo exclusivo de uma etapa (sem as etapas aninhadas) na requisição atual"""
+    if not PROFILING_ENABLED or not has_request_context() or 'etapas' not in g:
+        yield
+        return
+    quadro = {'filhos': 0.0}
+    g.pilha_etapas.append(quadro)
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        duracao = (time.perf_counter() - inicio) * 1000
+        g.pilha_etapas.pop()
+        g.etapas[nome] = g.etapas.get(nome, 0.0) + duracao - quadro['filhos']
+        if g.pilha_etapas:
+            g.pilha_etapas[-1]['filhos'] += duracao
+
+def perfilar_requisicao(func):
+    """Mede etapas, registra requisições lentas e perfila uma amostra das chamadas"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not PROFILING_ENABLED:
+            return func(*args, **kwargs)
+
+        g.etapas = {}
+        g.pilha_etapas = []
+        profiler = None
+        if random.random() < PROFILING_SAMPLE_RATE and perfilador.perfil_ativo.acquire(blocking=False):
+            profiler = cProfile.Profile()
+        inicio = time.perf_counter()
+        try:
+            if profiler:
+                return profiler.runcall(func, *args, **kwargs)
+            return func(*args, **kwargs)
+        finally:
+            duracao_ms = (time.perf_counter() - inicio) * 1000
+            try:
+                if profiler:
+                    perfilador.perfil_ativo.release()
+                    profiler.create_stats()
+                    dump_id = perfilador.adicionar_dump(request.path, duracao_ms, profiler.stats)
+                    app.logger.info(f"Perfil {dump_id} capturado para {request.path} ({duracao_ms:.1f} ms)")
+                if duracao_ms >= SLOW_REQUEST_MS:
+                    etapas = {nome: round(ms, 1) for nome, ms in g.etapas.items()}
+                    etapas['outros'] = round(duracao_ms - sum(g.etapas.values()), 1)
+                    perfilador.registrar_lenta({
+                        'rota': request.path,
+                        'duracao_ms': round(duracao_ms, 1),
+                        'timestamp': datetime.now().isoformat(),
+                        'etapas': etapas
+                    })
+                    app.logger.warning(f"Requisição lenta em {request.path}: {duracao_ms:.1f} ms | Etapas: {etapas}")
+            except Exception as e:
+                app.logger.error(f"Erro ao registrar perfilamento: {str(e)}")
+    return wrapper
+
+def admin_autorizado():
+    token = request.headers.get('X-Admin-Token', '')
+    return bool(PROFILING_TOKEN) and hmac.compare_digest(token, PROFILING_TOKEN)
+
+def rota_debug(func):
+    """Rotas de perfilamento só existem com PROFILING_ENABLED e exigem o token de admin"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not PROFILING_ENABLED:
+            return Response("Não encontrado", status=404)
+        if not admin_autorizado():
+            return Response("Não autorizado", status=403)
+        return func(*args, **kwargs)
+    return wrapper
+
+def capturar_pilhas_threads(amostras=1, intervalo=0.1):
+    """Amostra as pilhas de todas as threads e conta pilhas idênticas por thread"""
+    contagens = {}
+    atual = threading.get_ident()
+    for i in range(amostras):
+        if i:
+            time.sleep(intervalo)
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == atual:
+                continue
+            pilha = "".join(traceback.format_stack(frame))
+            contagens.setdefault(thread_id, Counter())[pilha] += 1
+
+    nomes = {t.ident: t.name for t in threading.enumerate()}
+    linhas = [f"{amostras} amostra(s) a cada {intervalo:.2f}s", ""]
+    for thread_id, pilhas in contagens.items():
+        linhas.append(f"--- Thread {nomes.get(thread_id, 'desconhecida')} ({thread_id}) ---")
+        for pilha, vezes in pilhas.most_common():
+            linhas.append(f"[{vezes}/{amostras} amostras]")
+            linhas.extend(linha.rstrip() for linha in pilha.splitlines())
+        linhas.append("")
+    return "\n".join(linhas)
+
 # Dados de usuários
 USUARIOS = {
     "+5511972508430": {"nome": "Cleverson", "empresa": "JCM", "nivel": 5, "ativo": True, "email": "cleverson@jcm.com"},
@@ -268,7 +438,7 @@ def registrar_reserva_google_sheets(dados):
         # ID de reserva único
         reserva_id = f"RES_{datetime.now().strftime('%Y%m%d%H%M%S')}"
         
-        # LISTA DE VALORES COM FORMATO EXIGIDO PELA PLANILHA (16 colunas)
+        # LISTA DE VALORES COM FORMATO EXIGIDO PELA PLANILHA (17 colunas)
         nova_linha = [
             reserva_id,                          # A: ID_Reserva
             dados.get('cliente', 'N/A'),         # B: Cliente
@@ -285,7 +455,8 @@ def registrar_reserva_google_sheets(dados):
             "",                                  # M: Data_Vencimento
             "",                                  # N: Valor_Entrada
             "",                                  # O: Link_Pagamento
-            ""                                   # P: Comprovante_Final
+            "",                                  # P: Comprovante_Final
+            ""                                   # Q: Status_Entrega
         ]
         
         app.logger.info(f"Registrando reserva: {nova_linha}")
@@ -331,73 +502,332 @@ def enviar_email_confirmacao(destinatario, reserva):
         app.logger.error(f"Erro ao enviar e-mail: {str(e)}")
         return False
 
+# ================= STATUS DE ENTREGA (TWILIO) =================
+# Ordem de progressão dos status; callbacks podem chegar fora de ordem
+ORDEM_STATUS = {
+    'accepted': 0, 'queued': 1, 'sending': 2, 'sent': 3,
+    'delivered': 4, 'undelivered': 5, 'failed': 5, 'read': 6
+}
+STATUS_FALHA = ('failed', 'undelivered')
+# Códigos de erro Twilio em que o reenvio falharia de novo (número inválido, fora da janela do WhatsApp, etc.)
+ERROS_PERMANENTES = {
+    '21211', '21408', '21610', '21614', '30004', '30005', '30006', '30007',
+    '63003', '63016', '63024'
+}
+
+class StatusEntregaIndex:
+    """Último status por mensagem, limitado em memória, com atualizações pendentes coalescidas"""
+    def __init__(self, max_itens):
+        self.lock = threading.Lock()
+        self.max_itens = max_itens
+        self.itens = OrderedDict()
+        self.pendentes = {}
+
+    def registrar_envio(self, sid, telefone, corpo, reserva_id=None, tentativas=0):
+        with self.lock:
+            self.itens[sid] = {
+                'sid': sid,
+                'telefone': telefone,
+                'corpo': corpo,
+                'reserva_id': reserva_id,
+                'tentativas': tentativas,
+                'status': 'queued',
+                'erro': None,
+                'atualizado_em': datetime.now().isoformat()
+            }
+            while len(self.itens) > self.max_itens:
+                self.itens.popitem(last=False)
+
+    def atualizar(self, sid, status, erro=None):
+        """Aplica um callback; retorna a mensagem se ela acabou de falhar"""
+        with self.lock:
+            item = self.itens.get(sid)
+            if item is None:
+                # Mensagem desconhecida (reinício ou descartada do índice)
+                app.logger.warning(f"Status '{status}' recebido para mensagem desconhecida {sid}")
+                return None
+            if ORDEM_STATUS.get(status, 0) < ORDEM_STATUS.get(item['status'], 0):
+                return None
+
+            status_anterior = item['status']
+            item['status'] = status
+            item['erro'] = erro
+            item['atualizado_em'] = datetime.now().isoformat()
+            self.itens.move_to_end(sid)
+            self.pendentes[sid] = {k: v for k, v in item.items() if k != 'corpo'}
+
+            if status in STATUS_FALHA and status_anterior not in STATUS_FALHA:
+                return dict(item)
+        return None
+
+    def extrair_pendentes(self):
+        with self.lock:
+            lote, self.pendentes = list(self.pendentes.values()), {}
+        return lote
+
+    def devolver_pendentes(self, lote):
+        """Recoloca um lote que não foi gravado, sem sobrescrever atualizações mais novas"""
+        descartados = 0
+        with self.lock:
+            for item in lote:
+                # Mensagens já descartadas do índice não voltam, para manter a memória limitada
+                if item['sid'] not in self.itens:
+                    descartados += 1
+                    continue
+                self.pendentes.setdefault(item['sid'], item)
+        if descartados:
+            app.logger.warning(f"{descartados} status de entrega descartados (mensagens fora do índice)")
+
+status_entregas = StatusEntregaIndex(STATUS_INDEX_MAX)
+validador_twilio = RequestValidator(TWILIO_AUTH_TOKEN)
+
+def enviar_whatsapp(telefone, corpo, reserva_id=None, tentativas=0):
+    """Envia mensagem pelo Twilio e registra o SID para acompanhar a entrega"""
+    if not twilio_client:
+        return None
+    parametros = {'body': corpo, 'from_': TWILIO_PHONE_NUMBER, 'to': telefone}
+    if STATUS_CALLBACK_URL:
+        parametros['status_callback'] = STATUS_CALLBACK_URL
+    msg = twilio_client.messages.create(**parametros)
+    status_entregas.registrar_envio(msg.sid, telefone, corpo, reserva_id, tentativas)
+    return msg.sid
+
+def agendar_reenvio(item):
+    if not item.get('corpo') or not item.get('telefone'):
+        app.logger.warning(f"Mensagem {item['sid']} falhou, mas não há dados para reenvio")
+        return
+    if item.get('erro') in ERROS_PERMANENTES:
+        app.logger.error(f"Mensagem {item['sid']} para {item['telefone']} falhou com erro permanente {item['erro']}; sem reenvio")
+        return
+    if item['tentativas'] >= STATUS_MAX_RETRIES:
+        app.logger.error(f"Mensagem {item['sid']} para {item['telefone']} falhou após {item['tentativas']} reenvios")
+        return
+    # Reenvio passa pela fila de lembretes, respeitando o limite de LEMBRETE_WORKERS
+    fila_lembretes.agendar(datetime.now() + timedelta(seconds=STATUS_RETRY_DELAY * (item['tentativas'] + 1)), {
+        'tipo': 'cliente',
+        'telefone': item['telefone'],
+        'reserva_id': item['reserva_id'],
+        'corpo': item['corpo'],
+        'tentativas': item['tentativas'] + 1,
+        'reenvio_de': item['sid']
+    })
+
+def atualizar_status_planilha(lote):
+    """Grava o último status de cada reserva em uma única chamada batch_update"""
+    por_reserva = {}
+    for item in sorted(lote, key=lambda item: item['atualizado_em']):
+        if item.get('reserva_id'):
+            por_reserva[item['reserva_id']] = item['status']
+    if not gc or not por_reserva:
+        return
+
+    sheet = gc.open_by_key(SHEET_KEY).worksheet("Reservas_JCM")
+    linhas = {reserva_id: i + 1 for i, reserva_id in enumerate(sheet.col_values(1))}
+    atualizacoes = [
+        {'range': f"Q{linhas[reserva_id]}", 'values': [[status]]}
+        for reserva_id, status in por_reserva.items() if reserva_id in linhas
+    ]
+    if atualizacoes:
+        sheet.batch_update(atualizacoes)
+
+def gravar_status_local(lote):
+    """Mantém no arquivo apenas o último status por SID, limitado a STATUS_INDEX_MAX mensagens"""
+    registros = OrderedDict()
+    if os.path.exists(STATUS_STORE_PATH):
+        with open(STATUS_STORE_PATH, encoding='utf-8') as f:
+            for linha in f:
+                try:
+                    item = json.loads(linha)
+                    registros[item['sid']] = item
+                except (ValueError, KeyError):
+                    continue
+    for item in lote:
+        registros.pop(item['sid'], None)
+        registros[item['sid']] = item
+    while len(registros) > STATUS_INDEX_MAX:
+        registros.popitem(last=False)
+
+    temporario = STATUS_STORE_PATH + '.tmp'
+    with open(temporario, 'w', encoding='utf-8') as f:
+        for item in registros.values():
+            f.write(json.dumps(item, ensure_ascii=False) + "\n")
+    os.replace(temporario, STATUS_STORE_PATH)
+
+def descarregar_status():
+    lote = status_entregas.extrair_pendentes()
+    if not lote:
+        return
+
+    gravado = True
+    try:
+        gravar_status_local(lote)
+    except OSError as e:
+        gravado = False
+        app.logger.error(f"Erro ao gravar status de entrega em {STATUS_STORE_PATH}: {str(e)}")
+    try:
+        atualizar_status_planilha(lote)
+    except Exception as e:
+        gravado = False
+        app.logger.error(f"Erro ao gravar status de entrega no Google Sheets: {str(e)}")
+
+    if gravado:
+        app.logger.info(f"{len(lote)} status de entrega gravados")
+    else:
+        # Tenta de novo na próxima descarga
+        status_entregas.devolver_pendentes(lote)
+
+def loop_status_entregas():
+    while True:
+        time.sleep(STATUS_FLUSH_INTERVAL)
+        try:
+            descarregar_status()
+        except Exception as e:
+            app.logger.error(f"Erro ao descarregar status de entrega: {str(e)}")
+
+threading.Thread(target=loop_status_entregas, name="status-entregas", daemon=True).start()
+
 # ================= SISTEMA DE LEMBRETES =================
+class FilaLembretes:
+    """Lembretes pendentes ordenados por horário, entregues em lotes por janela"""
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.heap = []
+        self.seq = 0
+
+    def agendar(self, horario, item):
+        with self.cond:
+            self.seq += 1
+            heapq.heappush(self.heap, (horario.timestamp(), self.seq, item))
+            self.cond.notify()
+
+    def proximo_lote(self, janela):
+        """Aguarda o próximo lembrete vencer e retorna todos que vencem até `janela` segundos depois"""
+        with self.cond:
+            while True:
+                if not self.heap:
+                    self.cond.wait()
+                    continue
+                espera = self.heap[0][0] - time.time()
+                if espera > 0:
+                    self.cond.wait(espera)
+                    continue
+                limite = time.time() + janela
+                lote = []
+                while self.heap and self.heap[0][0] <= limite:
+                    lote.append(heapq.heappop(self.heap)[2])
+                return lote
+
+    def pendentes_motorista(self, motorista, coleta_ate):
+        """Lembretes pendentes de um motorista com coleta até `coleta_ate`, sem retirá-los da fila"""
+        with self.cond:
+            return [entrada[2] for entrada in self.heap
+                    if entrada[2]['tipo'] == 'motorista' and entrada[2]['motorista'] == motorista
+                    and entrada[2]['coleta'] <= coleta_ate]
+
+fila_lembretes = FilaLembretes()
+executor_lembretes = ThreadPoolExecutor(max_workers=LEMBRETE_WORKERS, thread_name_prefix="lembretes")
+
 def agendar_lembretes(reserva):
     try:
         # Converter data/hora da reserva
         data_reserva = datetime.strptime(f"{reserva['data']} {reserva['hora']}", '%d/%m/%y %H:%M')
         
-        # Lembrete 1 dia antes
-        lembrete_1_dia = data_reserva - timedelta(days=1)
-        threading.Timer(
-            (lembrete_1_dia - datetime.now()).total_seconds(),
-            enviar_lembrete,
-            args=[reserva, "1 dia"]
-        ).start()
-        
-        # Lembrete 5 horas antes
-        lembrete_5_horas = data_reserva - timedelta(hours=5)
-        threading.Timer(
-            (lembrete_5_horas - datetime.now()).total_seconds(),
-            enviar_lembrete,
-            args=[reserva, "5 horas"]
-        ).start()
-        
-        # Lembrete para o motorista
-        threading.Timer(
-            (lembrete_1_dia - datetime.now()).total_seconds(),
-            enviar_lembrete_motorista,
-            args=[reserva, "1 dia"]
-        ).start()
-        
-        threading.Timer(
-            (lembrete_5_horas - datetime.now()).total_seconds(),
-            enviar_lembrete_motorista,
-            args=[reserva, "5 horas"]
-        ).start()
+        # Lembretes 1 dia e 5 horas antes, já renderizados
+        viagem_motorista = renderizar_lembrete_motorista(reserva)
+        for horario, tempo_antecedencia in [(data_reserva - timedelta(days=1), "1 dia"),
+                                            (data_reserva - timedelta(hours=5), "5 horas")]:
+            fila_lembretes.agendar(horario, {
+                'tipo': 'cliente',
+                'telefone': reserva['telefone'],
+                'reserva_id': reserva['id'],
+                'corpo': renderizar_lembrete(reserva, tempo_antecedencia)
+            })
+            
+            # Lembrete para o motorista (agrupado em um resumo por motorista no disparo)
+            fila_lembretes.agendar(horario, {
+                'tipo': 'motorista',
+                'motorista': reserva['motorista'],
+                'reserva_id': reserva['id'],
+                'tempo': tempo_antecedencia,
+                'coleta': data_reserva.timestamp(),
+                'linha': renderizar_lembrete_motorista(reserva, tempo_antecedencia),
+                'viagem': viagem_motorista
+            })
         
     except Exception as e:
         app.logger.error(f"Erro ao agendar lembretes: {str(e)}")
 
-def enviar_lembrete(reserva, tempo_antecedencia):
+def renderizar_lembrete(reserva, tempo_antecedencia):
+    return (
+        f"⏰ Lembrete de Reserva JCM\n\n"
+        f"Faltam {tempo_antecedencia} para seu transporte!\n\n"
+        f"ID Reserva: {reserva['id']}\n"
+        f"Origem: {reserva['origem']}\n"
+        f"Destino: {reserva['destino']}\n"
+        f"Data/Hora: {reserva['data']} {reserva['hora']}\n"
+        f"Motorista: {reserva['motorista']}\n\n"
+        f"Precisa de ajuda? Responda esta mensagem!"
+    )
+
+def renderizar_lembrete_motorista(reserva, tempo_antecedencia=None):
+    antecedencia = f" (em {tempo_antecedencia})" if tempo_antecedencia else ""
+    return (f"• {reserva['id']}{antecedencia}: {reserva['data']} {reserva['hora']} | "
+            f"{reserva['origem']} → {reserva['destino']} | {reserva.get('pessoas', 1)} pax")
+
+def enviar_lembrete(item):
     try:
-        if twilio_client:
-            mensagem = (
-                f"⏰ Lembrete de Reserva JCM\n\n"
-                f"Faltam {tempo_antecedencia} para seu transporte!\n\n"
-                f"ID Reserva: {reserva['id']}\n"
-                f"Origem: {reserva['origem']}\n"
-                f"Destino: {reserva['destino']}\n"
-                f"Data/Hora: {reserva['data']} {reserva['hora']}\n"
-                f"Motorista: {reserva['motorista']}\n\n"
-                f"Precisa de ajuda? Responda esta mensagem!"
-            )
-            
-            twilio_client.messages.create(
-                body=mensagem,
-                from_=TWILIO_PHONE_NUMBER,
-                to=reserva['telefone']
-            )
+        sid = enviar_whatsapp(item['telefone'], item['corpo'], item['reserva_id'], item.get('tentativas', 0))
+        if item.get('reenvio_de'):
+            app.logger.info(f"Reenvio de {item['reenvio_de']} (tentativa {item['tentativas']}): novo SID {sid}")
     except Exception as e:
         app.logger.error(f"Erro ao enviar lembrete: {str(e)}")
 
-def enviar_lembrete_motorista(reserva, tempo_antecedencia):
+def enviar_lembrete_motorista(motorista, linhas, proximas=()):
     try:
         # Simulação - na prática precisaria do número do motorista
-        app.logger.info(f"Lembrete para motorista {reserva['motorista']}: Reserva {reserva['id']} em {tempo_antecedencia}")
+        resumo = f"🚗 Lembretes de viagem ({len(linhas)}):\n" + "\n".join(linhas)
+        if proximas:
+            resumo += f"\n\n📅 Também nas próximas {LEMBRETE_HORIZONTE_MOTORISTA:g}h:\n" + "\n".join(proximas)
+        app.logger.info(f"Lembrete para motorista {motorista}:\n{resumo}")
     except Exception as e:
         app.logger.error(f"Erro ao enviar lembrete para motorista: {str(e)}")
 
+def despachar_lote_lembretes(lote):
+    """Um resumo por motorista e envios de clientes distribuídos entre os workers"""
+    por_motorista = {}
+    clientes = 0
+    for item in lote:
+        if item['tipo'] == 'motorista':
+            por_motorista.setdefault(item['motorista'], []).append(item)
+        else:
+            executor_lembretes.submit(enviar_lembrete, item)
+            clientes += 1
+    coleta_ate = time.time() + LEMBRETE_HORIZONTE_MOTORISTA * 3600
+    for motorista, itens in por_motorista.items():
+        # Um lembrete por viagem e antecedência; os demais continuam na fila
+        vencidos = {(item['reserva_id'], item['tempo']): item for item in itens}
+        linhas = [item['linha'] for item in sorted(vencidos.values(), key=lambda item: item['coleta'])]
+        
+        # Viagens próximas apenas listadas, sem consumir seus lembretes
+        ja_listadas = {reserva_id for reserva_id, _ in vencidos}
+        proximas = {}
+        for item in fila_lembretes.pendentes_motorista(motorista, coleta_ate):
+            if item['reserva_id'] not in ja_listadas:
+                proximas[item['reserva_id']] = item
+        linhas_proximas = [item['viagem'] for item in sorted(proximas.values(), key=lambda item: item['coleta'])]
+        
+        executor_lembretes.submit(enviar_lembrete_motorista, motorista, linhas, linhas_proximas)
+    app.logger.info(f"Lote de lembretes: {clientes} clientes, {len(por_motorista)} motoristas")
+
+def loop_lembretes():
+    while True:
+        try:
+            despachar_lote_lembretes(fila_lembretes.proximo_lote(LEMBRETE_JANELA))
+        except Exception as e:
+            app.logger.error(f"Erro ao despachar lembretes: {str(e)}")
+
+threading.Thread(target=loop_lembretes, name="lembretes", daemon=True).start()
+
 # ================= PROCESSADOR DE RESERVAS =================
 def processar_reserva(mensagem, telefone, cliente):
     """Processa mensagens de reserva com NLP simplificado"""
@@ -439,32 +869,35 @@ def processar_reserva(mensagem, telefone, cliente):
         state_manager.reservas[telefone] = reserva
         
         # Integração com Google Sheets
-        reserva_id = registrar_reserva_google_sheets({
-            'cliente': cliente['nome'],
-            'origem': dados['origem'],
-            'destino': dados['destino'],
-            'data': dados['data'],
-            'hora': dados['hora']
-        })
+        with medir_etapa('google_sheets'):
+            reserva_id = registrar_reserva_google_sheets({
+                'cliente': cliente['nome'],
+                'origem': dados['origem'],
+                'destino': dados['destino'],
+                'data': dados['data'],
+                'hora': dados['hora']
+            })
         
         if reserva_id:
             reserva['id'] = reserva_id
             
             # Agendar lembretes
-            agendar_lembretes(reserva)
+            with medir_etapa('lembretes'):
+                agendar_lembretes(reserva)
             
             # Enviar e-mail de confirmação
             if cliente.get('email'):
-                enviar_email_confirmacao(cliente['email'], {
-                    'id': reserva_id,
-                    'origem': dados['origem'],
-                    'destino': dados['destino'],
-                    'data': dados['data'],
-                    'hora': dados['hora'],
-                    'categoria': "Sedan Executivo",
-                    'valor': "300.00",
-                    'motorista': motorista
-                })
+                with medir_etapa('smtp'):
+                    enviar_email_confirmacao(cliente['email'], {
+                        'id': reserva_id,
+                        'origem': dados['origem'],
+                        'destino': dados['destino'],
+                        'data': dados['data'],
+                        'hora': dados['hora'],
+                        'categoria': "Sedan Executivo",
+                        'valor': "300.00",
+                        'motorista': motorista
+                    })
             
             state_manager.set_user_state(telefone, "MENU_RESERVA")
             return (f"✅ *Reserva confirmada!* 🚗\n\n"
@@ -544,6 +977,7 @@ def health_check():
     return Response("OK", status=200)
 
 @app.route("/webhook", methods=['POST'])
+@perfilar_requisicao
 def webhook():
     try:
         telefone = request.form.get('From', '')
@@ -565,7 +999,8 @@ def webhook():
             resp.message("❌ Você não tem permissão para acessar este sistema. Contate o administrador.")
             return str(resp)
         
-        resposta = processar_mensagem(mensagem_lower, mensagem, telefone, cliente)
+        with medir_etapa('processar_mensagem'):
+            resposta = processar_mensagem(mensagem_lower, mensagem, telefone, cliente)
         
         resp = MessagingResponse()
         resp.message(resposta)
@@ -577,6 +1012,55 @@ def webhook():
         resp.message("⚠️ Ops! Tivemos um problema técnico. Tente novamente em alguns instantes.")
         return str(resp)
 
+@app.route("/status-callback", methods=['POST'])
+def status_callback():
+    if not STATUS_CALLBACK_URL:
+        return Response("Não encontrado", status=404)
+    assinatura = request.headers.get('X-Twilio-Signature', '')
+    if not validador_twilio.validate(STATUS_CALLBACK_URL, request.form, assinatura):
+        return Response("Assinatura inválida", status=403)
+
+    sid = request.form.get('MessageSid', '')
+    status = request.form.get('MessageStatus', '').lower()
+    if not sid or not status:
+        return Response("Dados incompletos", status=400)
+
+    falha = status_entregas.atualizar(sid, status, request.form.get('ErrorCode'))
+    if falha:
+        agendar_reenvio(falha)
+    return Response(status=204)
+
+# ================= ROTAS DE PERFILAMENTO (ADMIN) =================
+@app.route('/debug/threads', methods=['GET'])
+@rota_debug
+def debug_threads():
+    try:
+        amostras = min(max(int(request.args.get('amostras', 1)), 1), 50)
+        intervalo = min(max(float(request.args.get('intervalo', 0.1)), 0.01), 0.5)
+    except ValueError:
+        return Response("Parâmetros inválidos", status=400)
+    return Response(capturar_pilhas_threads(amostras, intervalo), status=200, mimetype='text/plain')
+
+@app.route('/debug/profiles', methods=['GET'])
+@rota_debug
+def debug_listar_perfis():
+    return Response(json.dumps(perfilador.listar_dumps(), indent=2), status=200, mimetype='application/json')
+
+@app.route('/debug/profiles/<dump_id>', methods=['GET'])
+@rota_debug
+def debug_baixar_perfil(dump_id):
+    dump = perfilador.obter_dump(dump_id)
+    if not dump:
+        return Response("Perfil não encontrado", status=404)
+    # Formato compatível com pstats.Stats(arquivo)
+    return Response(dump['dados'], status=200, mimetype='application/octet-stream',
+                    headers={'Content-Disposition': f'attachment; filename={dump_id}.pstats'})
+
+@app.route('/debug/slow', methods=['GET'])
+@rota_debug
+def debug_requisicoes_lentas():
+    return Response(json.dumps(perfilador.listar_lentas(), indent=2), status=200, mimetype='application/json')
+
 def processar_mensagem(mensagem_lower, mensagem_original, telefone, cliente):
     estado_atual = state_manager.get_user_state(telefone)
     nome_cliente = cliente['nome'] if cliente['nome'] != "Convidado" else ""
@@ -679,11 +1163,7 @@ def processar_mensagem(mensagem_lower, mensagem_original, telefone, cliente):
 def enviar_lembrete_menu(telefone):
     try:
         if twilio_client:
-            twilio_client.messages.create(
-                body="⏰ Precisa de algo mais? Estou à disposição para ajudar!",
-                from_=TWILIO_PHONE_NUMBER,
-                to=telefone
-            )
+            enviar_whatsapp(telefone, "⏰ Precisa de algo mais? Estou à disposição para ajudar!")
     except Exception as e:
         app.logger.error(f"Erro ao enviar lembrete de menu: {str(e)}")
 